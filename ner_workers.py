@@ -0,0 +1,47 @@
+"""
+Natasha-конвейер для распознавания именованных сущностей
+Модели загружаются лениво при первом обращении, один раз на процесс
+"""
+
+import os
+import threading
+
+from natasha import Segmenter, NewsEmbedding, NewsNERTagger, Doc
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def _reset_lock():
+    """Новая блокировка в дочернем процессе: fork мог произойти, пока ее держал другой поток"""
+    global _pipeline_lock
+    _pipeline_lock = threading.Lock()
+
+
+# Пул процессов создается из рабочего потока бота, пока другие потоки могут обращаться к конвейеру
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock)
+
+
+def get_pipeline():
+    """Конвейер Natasha: (segmenter, ner_tagger)"""
+    global _pipeline
+    # Уже загруженный конвейер читается без блокировки
+    pipeline = _pipeline
+    if pipeline is None:
+        # Блокировка не дает параллельным потокам загрузить модели дважды
+        with _pipeline_lock:
+            if _pipeline is None:
+                # Морфологический анализ для NER не нужен: NewsNERTagger работает по токенам сегментатора,
+                # поэтому NewsMorphTagger и MorphVocab не загружаются
+                _pipeline = Segmenter(), NewsNERTagger(NewsEmbedding())
+            pipeline = _pipeline
+    return pipeline
+
+
+def warmup():
+    """Инициализатор процесса пула: прогрев моделей на коротком тексте"""
+    segmenter, ner_tagger = get_pipeline()
+    doc = Doc('Иван Петров работает в ООО «Ромашка» в Москве.')
+    doc.segment(segmenter)
+    doc.tag_ner(ner_tagger)
@@ -6,140 +6,478 @@ Telegram-бот для обезличивания юридических док
 """
 
 import os
+import asyncio
+import hashlib
 import re
 import logging
+import multiprocessing
+import tempfile
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-import PyPDF2
+import regex
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
 from docx import Document
+from docx.text.paragraph import Paragraph
 from pdf2docx import Converter
-from natasha import (
-    Segmenter, MorphVocab, NewsEmbedding, NewsMorphTagger, NewsNERTagger,
-    Doc
-)
+from natasha import Doc
+import ner_workers
+from ner_workers import get_pipeline
 
 # Настройка логирования
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Инициализация Natasha для распознавания именованных сущностей
-segmenter = Segmenter()
-morph_vocab = MorphVocab()
-emb = NewsEmbedding()
-morph_tagger = NewsMorphTagger(emb)
-ner_tagger = NewsNERTagger(emb)
+
+def _num_repl(match: regex.Match) -> str:
+    """Подбор метки для числового реквизита (DocumentAnonymizer._RE_NUMERIC) по длине и префиксу"""
+    s = match.group()
+    n = len(s)
+    # ИНН (10 или 12 цифр)
+    if n == 10 or n == 12:
+        return '[ИНН]'
+    # ОГРН (13 цифр)
+    if n == 13:
+        return '[ОГРН]'
+    # ОГРНИП (15 цифр)
+    if n == 15:
+        return '[ОГРНИП]'
+    # БИК (9 цифр, начинается с 04) или КПП (9 цифр)
+    if n == 9:
+        return '[БИК]' if s.startswith('04') else '[КПП]'
+    # Корреспондентский (начинается с 301) или расчетный счет (20 цифр)
+    if n == 20:
+        return '[К/С]' if s.startswith('301') else '[Р/С]'
+    return s
+
+
+# Разделитель фрагментов документа при пакетной обработке NER
+BATCH_SEPARATOR = '\n\x1e\n'
+
+# Пул процессов для параллельного NER на больших документах
+NER_WORKERS = os.cpu_count() or 1
+# Документы с меньшим числом фрагментов обрабатываются в текущем процессе
+PARALLEL_MIN_FRAGMENTS = 64
+
+_ner_pool = None
+_ner_pool_lock = threading.Lock()
+
+
+def get_ner_pool() -> ProcessPoolExecutor:
+    """Общий пул процессов NER, создается при первом обращении"""
+    global _ner_pool
+    with _ner_pool_lock:
+        if _ner_pool is None:
+            # Модели загружаются до создания процессов: при fork они достаются дочерним
+            # процессам через общие страницы памяти, а не загружаются заново в каждом
+            get_pipeline()
+            # fork задается явно: с Python 3.14 по умолчанию используется forkserver, при котором модели
+            # загружались бы в каждом процессе заново. Там, где fork недоступен, остается способ по умолчанию
+            mp_context = None
+            if 'fork' in multiprocessing.get_all_start_methods():
+                mp_context = multiprocessing.get_context('fork')
+            _ner_pool = ProcessPoolExecutor(
+                max_workers=NER_WORKERS, mp_context=mp_context, initializer=ner_workers.warmup
+            )
+        return _ner_pool
+
+
+def reset_ner_pool(pool: ProcessPoolExecutor):
+    """Остановка сломанного пула (например, после падения процесса по памяти): следующий запрос создаст новый"""
+    global _ner_pool
+    with _ner_pool_lock:
+        # Пул мог уже пересоздать другой поток, новый пул не трогаем
+        if _ner_pool is pool:
+            _ner_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
 
 # Токен бота (замените на свой)
 BOT_TOKEN = 'YOUR_BOT_TOKEN_HERE'
 
-class DocumentAnonymizer:
-    """Класс для обезличивания текста"""
 
-    @staticmethod
-    def anonymize_with_regex(text: str) -> str:
-        """Обезличивание с помощью регулярных выражений"""
+class NerCache:
+    """Потокобезопасный LRU-кэш результатов NER по хешу текста фрагмента"""
 
-        # ИНН (10 или 12 цифр)
-        text = re.sub(r'\b\d{10}(?!\d)|\b\d{12}(?!\d)', '[ИНН]', text)
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
 
-        # ОГРН (13 цифр) и ОГРНИП (15 цифр)
-        text = re.sub(r'\b\d{13}(?!\d)', '[ОГРН]', text)
-        text = re.sub(r'\b\d{15}(?!\d)', '[ОГРНИП]', text)
+    @staticmethod
+    def key(text: str) -> bytes:
+        """Ключ фрагмента: в кэше хранятся только хеши текста и смещения с метками, сам текст не хранится"""
+        return hashlib.blake2b(text.encode()).digest()
+
+    def get(self, text: str):
+        """Найденные сущности фрагмента или None, если фрагмента нет в кэше"""
+        key = self.key(text)
+        with self._lock:
+            spans = self._data.get(key)
+            if spans is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return spans
+
+    def put(self, text: str, spans: tuple):
+        """Сохранение сущностей фрагмента с вытеснением самого давнего"""
+        key = self.key(text)
+        with self._lock:
+            self._data[key] = spans
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def reset_lock(self):
+        """Новая блокировка в дочернем процессе: fork мог произойти, пока ее держал другой поток"""
+        self._lock = threading.Lock()
+
+    def info(self) -> str:
+        """Статистика кэша для логов"""
+        with self._lock:
+            return f"попаданий {self.hits}, промахов {self.misses}, записей {len(self._data)}/{self.maxsize}"
+
+
+# Шаблонные пункты, реквизиты сторон и колонтитулы повторяются дословно от документа к документу
+ner_cache = NerCache(maxsize=4096)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=ner_cache.reset_lock)
 
-        # КПП (9 цифр)
-        text = re.sub(r'\b\d{9}(?!\d)', '[КПП]', text)
 
-        # БИК (9 цифр, начинается с 04)
-        text = re.sub(r'\b04\d{7}(?!\d)', '[БИК]', text)
+class DocumentAnonymizer:
+    """Класс для обезличивания текста"""
 
-        # Расчетный счет (20 цифр)
-        text = re.sub(r'\b\d{20}(?!\d)', '[Р/С]', text)
+    __slots__ = ()
+
+    # Регулярные выражения и таблицы меток компилируются один раз при загрузке класса
+    # Числовые реквизиты (ИНН, ОГРН, ОГРНИП, КПП, БИК, Р/С, К/С) ищутся за один проход,
+    # тип определяется по длине и префиксу числа. Модуль regex на этом шаблоне примерно вдвое быстрее re
+    _RE_NUMERIC = regex.compile(r'\b\d{9,20}(?!\d)')
+    # Телефоны
+    _RE_PHONE = re.compile(r'(\+7|8|7)?[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}')
+    # Email
+    _RE_EMAIL = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+    # Серия и номер паспорта (12 34 567890)
+    _RE_PASSPORT = re.compile(r'\b\d{2}\s*\d{2}\s*\d{6}\b')
+    # СНИЛС (123-456-789 01)
+    _RE_SNILS = re.compile(r'\b\d{3}[\-\s]?\d{3}[\-\s]?\d{3}[\s]?\d{2}\b')
+
+    # Слово на кириллице с заглавной буквы; без таких слов NER не найдет ФИО, организаций и адресов
+    _RE_CYRILLIC_WORD = re.compile(r'[А-ЯЁ][А-ЯЁа-яё]{2,}')
+
+    # Быстрые предфильтры: шаблон не применяется к тексту, в котором нет обязательного символа
+    _RE_HAS_DIGIT = re.compile(r'\d')
+    _RE_HAS_AT = re.compile('@')
+
+    # Порядок применения замен важен: сначала числовые реквизиты
+    # Элементы: (шаблон, замена, предфильтр)
+    _REGEX_PIPELINE = (
+        (_RE_NUMERIC, _num_repl, _RE_HAS_DIGIT),
+        (_RE_PHONE, '[ТЕЛЕФОН]', _RE_HAS_DIGIT),
+        (_RE_EMAIL, '[EMAIL]', _RE_HAS_AT),
+        (_RE_PASSPORT, '[ПАСПОРТ]', _RE_HAS_DIGIT),
+        (_RE_SNILS, '[СНИЛС]', _RE_HAS_DIGIT),
+    )
+
+    # Нормализация служебных символов в копии текста для поиска: неразрывный пробел, разделители строк
+    # и абзацев, BOM. Замены не меняют длину, поэтому найденные смещения верны и для исходного текста,
+    # а в документ эти символы возвращаются нетронутыми
+    _TRANS = str.maketrans({'\u00a0': ' ', '\u2028': '\n', '\u2029': '\n', '\ufeff': ' '})
+
+    # Метки для типов сущностей Natasha
+    _NER_LABELS = {
+        'PER': '[ФИО]',  # Персона (ФИО)
+        'ORG': '[ОРГАНИЗАЦИЯ]',  # Организация
+        'LOC': '[АДРЕС]',  # Локация (адрес)
+    }
+
+    # Символ, которым закрываются найденные реквизиты, чтобы следующие шаблоны их не задевали
+    _MASK = '\x00'
 
-        # Корреспондентский счет
-        text = re.sub(r'\b301\d{17}(?!\d)', '[К/С]', text)
+    @staticmethod
+    def mask_spans(text: str, spans, char: str) -> str:
+        """Замена участков (start, stop, label) символом char с сохранением длины текста"""
+        parts = []
+        pos = 0
+        for start, stop, _ in spans:
+            parts.append(text[pos:start])
+            parts.append(char * (stop - start))
+            pos = stop
+        parts.append(text[pos:])
+        return ''.join(parts)
 
-        # Телефоны
-        text = re.sub(r'(\+7|8|7)?[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}', '[ТЕЛЕФОН]', text)
+    @staticmethod
+    def find_regex_spans(text: str) -> list:
+        """Поиск структурированных данных регулярными выражениями: список (start, stop, label)"""
+        found = []
+        for pattern, replacement, prefilter in DocumentAnonymizer._REGEX_PIPELINE:
+            if prefilter.search(text) is None:
+                continue
+
+            spans = []
+            for match in pattern.finditer(text):
+                label = replacement(match) if callable(replacement) else replacement
+                if label != match.group():
+                    spans.append((match.start(), match.end(), label))
+            if spans:
+                # Найденное закрывается маской той же длины: смещения остаются смещениями исходного текста
+                text = DocumentAnonymizer.mask_spans(text, spans, DocumentAnonymizer._MASK)
+                found.extend(spans)
+
+        return sorted(found)
 
-        # Email
-        text = re.sub(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', '[EMAIL]', text)
+    @staticmethod
+    def merge_spans(*span_lists) -> list:
+        """Объединение найденных участков в упорядоченный список без пересечений"""
+        # Сортировка устойчива: при одинаковом начале побеждает участок из более раннего списка
+        merged = []
+        pos = 0
+        for span in sorted((span for spans in span_lists for span in spans), key=lambda x: x[0]):
+            if span[0] < pos:  # Пересекается с уже принятым участком
+                continue
+            merged.append(span)
+            pos = span[1]
+        return merged
 
-        # Серия и номер паспорта (12 34 567890)
-        text = re.sub(r'\b\d{2}\s*\d{2}\s*\d{6}\b', '[ПАСПОРТ]', text)
+    @staticmethod
+    def replace_spans(text: str, spans) -> str:
+        """Замена участков (start, stop, label) метками"""
+        # Собираем результат за один проход слева направо: куски текста между участками и метки
+        parts = []
+        pos = 0
+        for start, stop, label in spans:
+            parts.append(text[pos:start])
+            parts.append(label)
+            pos = stop
+
+        parts.append(text[pos:])
+        return ''.join(parts)
 
-        # СНИЛС (123-456-789 01)
-        text = re.sub(r'\b\d{3}[\-\s]?\d{3}[\-\s]?\d{3}[\s]?\d{2}\b', '[СНИЛС]', text)
+    @staticmethod
+    def has_ner_candidates(text: str) -> bool:
+        """Есть ли в тексте слова на кириллице с заглавной буквы (кандидаты в ФИО, организации, адреса)"""
+        return len(text) >= 4 and DocumentAnonymizer._RE_CYRILLIC_WORD.search(text) is not None
 
-        return text
+    @staticmethod
+    def find_spans(texts: list) -> list:
+        """Поиск всех замен для набора фрагментов документа: regex + один проход NER"""
+        texts = [text.translate(DocumentAnonymizer._TRANS) for text in texts]
+        regex_spans = [DocumentAnonymizer.find_regex_spans(text) for text in texts]
+        # NER получает текст, в котором найденные реквизиты заменены пробелами той же длины
+        ner_texts = [
+            DocumentAnonymizer.mask_spans(text, spans, ' ')
+            for text, spans in zip(texts, regex_spans)
+        ]
+        ner_spans = DocumentAnonymizer.find_ner_spans(ner_texts)
+        return [
+            DocumentAnonymizer.merge_spans(text_regex_spans, text_ner_spans)
+            for text_regex_spans, text_ner_spans in zip(regex_spans, ner_spans)
+        ]
 
     @staticmethod
-    def anonymize_with_ner(text: str) -> str:
-        """Обезличивание с помощью NER (Named Entity Recognition)"""
+    def anonymize_batch(texts: list) -> list:
+        """Полное обезличивание набора фрагментов документа: regex + один проход NER"""
+        return [
+            DocumentAnonymizer.replace_spans(text, spans)
+            for text, spans in zip(texts, DocumentAnonymizer.find_spans(texts))
+        ]
+
+    @staticmethod
+    def find_ner_spans(texts: list) -> list:
+        """Поиск ФИО, организаций и адресов за один проход Natasha: для каждого фрагмента (start, stop, label)"""
+        # Повторяющиеся фрагменты обрабатываем один раз, уже встречавшиеся берем из кэша,
+        # фрагменты без кандидатов в сущности в NER не передаем
+        found = {}
+        unique_texts = []
+        for text in dict.fromkeys(texts):
+            if not DocumentAnonymizer.has_ner_candidates(text):
+                continue
+            spans = ner_cache.get(text)
+            if spans is None:
+                unique_texts.append(text)
+            else:
+                found[text] = spans
+        if not unique_texts:
+            return [found.get(text, ()) for text in texts]
+
+        # Склеиваем фрагменты через разделитель и запоминаем их смещения
+        offsets = []
+        cursor = 0
+        for text in unique_texts:
+            offsets.append(cursor)
+            cursor += len(text) + len(BATCH_SEPARATOR)
+
         try:
-            doc = Doc(text)
+            segmenter, ner_tagger = get_pipeline()
+            doc = Doc(BATCH_SEPARATOR.join(unique_texts))
             doc.segment(segmenter)
-            doc.tag_morph(morph_tagger)
             doc.tag_ner(ner_tagger)
-
-            # Сортируем сущности по убыванию позиции, чтобы замены не влияли на индексы
-            entities = sorted(doc.spans, key=lambda x: x.start, reverse=True)
-
-            text_list = list(text)
-            for span in entities:
-                if span.type == 'PER':  # Персона (ФИО)
-                    replacement = '[ФИО]'
-                elif span.type == 'ORG':  # Организация
-                    replacement = '[ОРГАНИЗАЦИЯ]'
-                elif span.type == 'LOC':  # Локация (адрес)
-                    replacement = '[АДРЕС]'
-                else:
-                    continue
-
-                # Заменяем текст
-                text_list[span.start:span.stop] = replacement
-
-            return ''.join(text_list)
         except Exception as e:
             logger.error(f"Ошибка NER: {e}")
-            return text
-
-    @staticmethod
-    def full_anonymize(text: str) -> str:
-        """Полное обезличивание: regex + NER"""
-        # Сначала применяем regex для структурированных данных
-        text = DocumentAnonymizer.anonymize_with_regex(text)
-        # Затем NER для имен и организаций
-        text = DocumentAnonymizer.anonymize_with_ner(text)
-        return text
+            return [found.get(text, ()) for text in texts]
+
+        # Раскладываем сущности обратно по исходным фрагментам
+        entities = [[] for _ in unique_texts]
+        for span in doc.spans:
+            label = DocumentAnonymizer._NER_LABELS.get(span.type)
+            if label is None:
+                continue
+            index = bisect_right(offsets, span.start) - 1
+            # Сущность, пересекающая разделитель, обрезается по границам каждого фрагмента
+            while index < len(unique_texts) and offsets[index] < span.stop:
+                start = max(span.start - offsets[index], 0)
+                stop = min(span.stop - offsets[index], len(unique_texts[index]))
+                if start < stop:
+                    entities[index].append((start, stop, label))
+                index += 1
+
+        for text, text_entities in zip(unique_texts, entities):
+            found[text] = tuple(text_entities)
+            ner_cache.put(text, found[text])
+        return [found.get(text, ()) for text in texts]
 
 
 class FileProcessor:
     """Класс для обработки файлов"""
 
+    # Содержимое параграфа, которое не попадает в paragraph.text и paragraph.runs
+    _HIDDEN_CONTENT_XPATH = './w:ins|./w:smartTag|./w:sdt|./w:fldSimple'
+
     @staticmethod
     def process_docx(input_path: str, output_path: str):
         """Обработка DOCX файла"""
         doc = Document(input_path)
 
-        # Обрабатываем параграфы
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                anonymized = DocumentAnonymizer.full_anonymize(paragraph.text)
-                paragraph.text = anonymized
+        # Собираем параграфы документа, таблиц и надписей, чтобы прогнать NER один раз на весь документ
+        paragraphs = []
+        seen = set()
+        FileProcessor.collect_paragraphs(doc.paragraphs, paragraphs, seen)
+        FileProcessor.collect_table_paragraphs(doc.tables, paragraphs, seen)
+
+        # paragraph.text собирается из XML при каждом обращении, поэтому читаем его один раз
+        elements = []
+        texts = []
+        rewrites = []
+        for paragraph in paragraphs:
+            # Текст исправлений, смарт-тегов, элементов управления и простых полей не входит
+            # в paragraph.text: такие параграфы обезличиваются по полному тексту и перезаписываются целиком
+            rewrite = bool(paragraph._p.xpath(FileProcessor._HIDDEN_CONTENT_XPATH))
+            if rewrite:
+                text = FileProcessor.full_paragraph_text(paragraph)
+            else:
+                text = paragraph.text
+            if text.strip() or rewrite:
+                elements.append(paragraph)
+                texts.append(text)
+                rewrites.append(rewrite)
+
+        if len(texts) < PARALLEL_MIN_FRAGMENTS:
+            spans = DocumentAnonymizer.find_spans(texts)
+        else:
+            # Делим документ на части по числу процессов, каждая часть - отдельный пакет NER
+            size = -(-len(texts) // NER_WORKERS)
+            shards = [texts[i:i + size] for i in range(0, len(texts), size)]
+            pool = get_ner_pool()
+            try:
+                spans = []
+                for result in pool.map(DocumentAnonymizer.find_spans, shards):
+                    spans.extend(result)
+            except BrokenProcessPool as e:
+                logger.error(f"Пул процессов NER неработоспособен, документ обрабатывается в текущем процессе: {e}")
+                reset_ner_pool(pool)
+                spans = DocumentAnonymizer.find_spans(texts)
+
+        for paragraph, text, paragraph_spans, rewrite in zip(elements, texts, spans, rewrites):
+            if rewrite:
+                paragraph.text = DocumentAnonymizer.replace_spans(text, paragraph_spans)
+            elif paragraph_spans:
+                FileProcessor.replace_paragraph_spans(paragraph, text, paragraph_spans)
+
+        doc.save(output_path)
+
+    @staticmethod
+    def full_paragraph_text(paragraph) -> str:
+        """Текст всех фрагментов (run) параграфа, включая вложенные, кроме текста надписей"""
+        # Надписи обрабатываются как отдельные параграфы
+        nested = set(paragraph._p.xpath('.//w:txbxContent//w:r'))
+        return ''.join(r.text for r in paragraph._p.xpath('.//w:r') if r not in nested)
+
+    @staticmethod
+    def collect_paragraphs(source, paragraphs: list, seen: set):
+        """Добавление параграфов и параграфов их надписей (text box) в список без повторов"""
+        for paragraph in source:
+            # Объединенные ячейки повторяются в row.cells, обрабатываем их один раз
+            if paragraph._p in seen:
+                continue
+            seen.add(paragraph._p)
+            paragraphs.append(paragraph)
+            # Надписи не входят в doc.paragraphs, их параграфы обезличиваются как обычные
+            FileProcessor.collect_paragraphs(
+                (Paragraph(p, paragraph) for p in paragraph._p.xpath('.//w:txbxContent//w:p')), paragraphs, seen
+            )
 
-        # Обрабатываем таблицы
-        for table in doc.tables:
+    @staticmethod
+    def collect_table_paragraphs(tables, paragraphs: list, seen: set):
+        """Добавление параграфов ячеек таблиц, включая вложенные таблицы"""
+        for table in tables:
             for row in table.rows:
                 for cell in row.cells:
-                    if cell.text.strip():
-                        anonymized = DocumentAnonymizer.full_anonymize(cell.text)
-                        cell.text = anonymized
+                    FileProcessor.collect_paragraphs(cell.paragraphs, paragraphs, seen)
+                    FileProcessor.collect_table_paragraphs(cell.tables, paragraphs, seen)
 
-        doc.save(output_path)
+    @staticmethod
+    def replace_paragraph_spans(paragraph, text: str, spans):
+        """Замена участков (start, stop, label) параграфа с сохранением форматирования отдельных фрагментов (run)"""
+        runs = paragraph.runs
+        run_texts = [run.text for run in runs]
+        # Гиперссылки не входят в paragraph.runs, а их адрес тоже может содержать персональные данные:
+        # такие параграфы перезаписываем целиком
+        if paragraph.hyperlinks or not runs or ''.join(run_texts) != text:
+            paragraph.text = DocumentAnonymizer.replace_spans(text, spans)
+            return
+
+        starts = []
+        cursor = 0
+        for run_text in run_texts:
+            starts.append(cursor)
+            cursor += len(run_text)
+
+        pieces = [[] for _ in runs]
+        pos = 0
+        for start, stop, label in list(spans) + [(len(text), len(text), '')]:
+            # Текст между участками остается в своих фрагментах
+            while pos < start:
+                index = bisect_right(starts, pos) - 1
+                end = min(start, starts[index] + len(run_texts[index]))
+                pieces[index].append(text[pos:end])
+                pos = end
+            # Метка попадает во фрагмент, где начинается участок, из остальных фрагментов участок удаляется
+            if label:
+                pieces[bisect_right(starts, start) - 1].append(label)
+            pos = stop
+
+        for run, run_text, run_pieces in zip(runs, run_texts, pieces):
+            new_run_text = ''.join(run_pieces)
+            if new_run_text != run_text:
+                run.text = new_run_text
 
     @staticmethod
     def process_pdf(input_path: str, output_path: str):
         """Обработка PDF файла (конвертация в DOCX с обезличиванием)"""
+        # В PDF без изображений и графики нечего восстанавливать, конвертация в DOCX не нужна
+        if FileProcessor.is_text_only_pdf(input_path):
+            FileProcessor.process_pdf_simple(input_path, output_path)
+            return
+
         temp_docx = input_path.replace('.pdf', '_temp.docx')
 
         try:
@@ -160,17 +498,53 @@ class FileProcessor:
             # Если не удалось конвертировать, используем простое извлечение текста
             FileProcessor.process_pdf_simple(input_path, output_path)
 
+    @staticmethod
+    def is_text_only_pdf(input_path: str) -> bool:
+        """Проверка, что PDF содержит только текстовые объекты (без изображений, графики и таблиц)"""
+        try:
+            pdf = pdfium.PdfDocument(input_path)
+        except Exception as e:
+            logger.error(f"Ошибка чтения PDF: {e}")
+            return False
+
+        try:
+            for page in pdf:
+                try:
+                    for obj in page.get_objects():
+                        if obj.type != pdfium_c.FPDF_PAGEOBJ_TEXT:
+                            return False
+                finally:
+                    page.close()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка чтения PDF: {e}")
+            return False
+        finally:
+            pdf.close()
+
     @staticmethod
     def process_pdf_simple(input_path: str, output_path: str):
         """Простая обработка PDF (извлечение текста без сохранения форматирования)"""
-        pdf_reader = PyPDF2.PdfReader(input_path)
+        pdf = pdfium.PdfDocument(input_path)
         doc = Document()
 
-        for page in pdf_reader.pages:
-            text = page.extract_text()
-            if text.strip():
-                anonymized = DocumentAnonymizer.full_anonymize(text)
-                doc.add_paragraph(anonymized)
+        texts = []
+        try:
+            for page in pdf:
+                textpage = page.get_textpage()
+                # PDFium завершает строки \r\n, а python-docx превращает и \r, и \n в отдельный разрыв строки
+                text = textpage.get_text_bounded().replace('\r\n', '\n').replace('\r', '\n')
+                textpage.close()
+                page.close()
+
+                if text.strip():
+                    texts.append(text)
+        finally:
+            pdf.close()
+
+        # Все страницы обезличиваются одним пакетом NER
+        for anonymized in DocumentAnonymizer.anonymize_batch(texts):
+            doc.add_paragraph(anonymized)
 
         doc.save(output_path)
 
@@ -249,34 +623,31 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("⏳ Обрабатываю документ... Это может занять некоторое время.")
 
     try:
-        # Скачиваем файл
-        file = await context.bot.get_file(document.file_id)
-        input_path = f"input_{document.file_name}"
-        await file.download_to_drive(input_path)
-
-        # Определяем выходной файл
-        output_filename = document.file_name.replace('.pdf', '_anonymized.docx').replace('.docx', '_anonymized.docx')
-        output_path = f"output_{output_filename}"
-
-        # Обрабатываем файл
-        if document.file_name.endswith('.pdf'):
-            FileProcessor.process_pdf(input_path, output_path)
-        else:
-            FileProcessor.process_docx(input_path, output_path)
-
-        # Отправляем результат
-        with open(output_path, 'rb') as f:
-            await update.message.reply_document(
-                document=f,
-                filename=output_filename,
-                caption="✅ Документ успешно обезличен!\n\n⚠️ Проверьте результат перед использованием."
-            )
-
-        # Удаляем временные файлы
-        if os.path.exists(input_path):
-            os.remove(input_path)
-        if os.path.exists(output_path):
-            os.remove(output_path)
+        # Все файлы запроса живут во временном каталоге, который удаляется автоматически
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Скачиваем файл
+            file = await context.bot.get_file(document.file_id)
+            input_path = os.path.join(tmp_dir, os.path.basename(document.file_name))
+            await file.download_to_drive(input_path)
+
+            # Определяем выходной файл
+            base, _ = os.path.splitext(os.path.basename(document.file_name))
+            output_filename = f"{base}_anonymized.docx"
+            output_path = os.path.join(tmp_dir, output_filename)
+
+            # Обрабатываем файл в отдельном потоке, чтобы не блокировать цикл событий бота
+            if document.file_name.endswith('.pdf'):
+                await asyncio.to_thread(FileProcessor.process_pdf, input_path, output_path)
+            else:
+                await asyncio.to_thread(FileProcessor.process_docx, input_path, output_path)
+
+            # Отправляем результат
+            with open(output_path, 'rb') as f:
+                await update.message.reply_document(
+                    document=f,
+                    filename=output_filename,
+                    caption="✅ Документ успешно обезличен!\n\n⚠️ Проверьте результат перед использованием."
+                )
 
     except Exception as e:
         logger.error(f"Ошибка обработки документа: {e}")
@@ -285,14 +656,9 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Пожалуйста, попробуйте еще раз или отправьте другой файл."
         )
 
-        # Очистка файлов в случае ошибки
-        try:
-            if os.path.exists(input_path):
-                os.remove(input_path)
-            if os.path.exists(output_path):
-                os.remove(output_path)
-        except:
-            pass
+    finally:
+        # В больших документах NER выполняется в процессах пула со своими кэшами, их статистика сюда не входит
+        logger.info(f"Кэш NER основного процесса: {ner_cache.info()}")
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -300,10 +666,22 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Update {update} caused error {context.error}")
 
 
+async def post_init(application: Application):
+    """Настройка пула потоков для обработки документов"""
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=os.cpu_count()))
+
+
 def main():
     """Запуск бота"""
     # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Обновления от разных пользователей обрабатываются параллельно
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .build()
+    )
 
     # Регистрируем обработчики
     application.add_handler(CommandHandler("start", start))
@@ -0,0 +1,232 @@
+"""
+Тесты обезличивания документов
+Запуск: python -m pytest
+"""
+
+import ctypes
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from docx import Document
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+
+import telegram_anonymizer_bot
+from telegram_anonymizer_bot import DocumentAnonymizer, FileProcessor, ner_cache
+
+
+def _process(tmp_path, build):
+    """Создание DOCX, обработка FileProcessor.process_docx и загрузка результата"""
+    input_path = str(tmp_path / 'input.docx')
+    output_path = str(tmp_path / 'output.docx')
+    doc = Document()
+    build(doc)
+    doc.save(input_path)
+    FileProcessor.process_docx(input_path, output_path)
+    return Document(output_path)
+
+
+def _make_text_pdf(path, lines, with_rect=False):
+    """Создание одностраничного PDF с текстом и, при with_rect, с векторной рамкой"""
+    pdf = pdfium.PdfDocument.new()
+    page = pdf.new_page(595, 842)
+    if with_rect:
+        rect = pdfium_c.FPDFPageObj_CreateNewRect(40, 700, 300, 120)
+        pdfium_c.FPDFPath_SetDrawMode(rect, pdfium_c.FPDF_FILLMODE_NONE, True)
+        pdfium_c.FPDFPage_InsertObject(page, rect)
+    for i, line in enumerate(lines):
+        obj = pdfium_c.FPDFPageObj_NewTextObj(pdf, b'Helvetica', 12.0)
+        buffer = ctypes.create_string_buffer((line + '\x00').encode('utf-16-le'))
+        pdfium_c.FPDFText_SetText(obj, ctypes.cast(buffer, ctypes.POINTER(pdfium_c.FPDF_WCHAR)))
+        pdfium_c.FPDFPageObj_Transform(obj, 1, 0, 0, 1, 50, 800 - 20 * i)
+        pdfium_c.FPDFPage_InsertObject(page, obj)
+    pdfium_c.FPDFPage_GenerateContent(page)
+    page.close()
+    pdf.save(path)
+    pdf.close()
+
+
+def test_regex_spans_use_original_offsets():
+    text = 'ИНН 7707083893, тел. +7 (495) 123-45-67, почта a.b@mail.ru'
+    spans = DocumentAnonymizer.find_regex_spans(text)
+
+    assert [label for _, _, label in spans] == ['[ИНН]', '[ТЕЛЕФОН]', '[EMAIL]']
+    assert text[spans[0][0]:spans[0][1]] == '7707083893'
+    assert text[spans[2][0]:spans[2][1]] == 'a.b@mail.ru'
+    assert DocumentAnonymizer.replace_spans(text, spans) == 'ИНН [ИНН], тел. [ТЕЛЕФОН], почта [EMAIL]'
+
+
+def test_numeric_requisites_are_labelled_by_length_and_prefix():
+    text = 'КПП 773601001 БИК 044525225 р/с 40702810400000012345 к/с 30101810400000000225'
+    anonymized = DocumentAnonymizer.anonymize_batch([text])[0]
+
+    assert anonymized == 'КПП [КПП] БИК [БИК] р/с [Р/С] к/с [К/С]'
+
+
+def test_long_paragraph_keeps_run_formatting(tmp_path):
+    sentence = ' между Иван Петров и Сергей Смирнов, ИНН 7707083893, стороны. '
+
+    def build(doc):
+        paragraph = doc.add_paragraph()
+        for _ in range(4):
+            paragraph.add_run('Договор ')
+            paragraph.add_run('заключен').bold = True
+            paragraph.add_run(sentence)
+
+    paragraph = _process(tmp_path, build).paragraphs[0]
+    runs = paragraph.runs
+
+    assert len(runs) == 12
+    for i in range(0, 12, 3):
+        assert runs[i].text == 'Договор '
+        assert runs[i + 1].text == 'заключен'
+        assert runs[i + 1].bold
+        assert runs[i + 2].text == ' между [ФИО] и [ФИО], ИНН [ИНН], стороны. '
+
+
+def test_very_long_paragraph_keeps_run_boundaries(tmp_path):
+    chunk = 'обязательства сторон по договору поставки ИНН 7707083893 исполняются в срок. '
+    run_texts = [(chunk * 7)[:500] for _ in range(26)]
+
+    def build(doc):
+        paragraph = doc.add_paragraph()
+        for run_text in run_texts:
+            paragraph.add_run(run_text)
+
+    runs = _process(tmp_path, build).paragraphs[0].runs
+
+    assert len(runs) == len(run_texts)
+    assert all(run.text for run in runs)
+    assert '7707083893' not in ''.join(run.text for run in runs)
+
+
+def test_paragraph_without_findings_is_not_rewritten(tmp_path):
+    def build(doc):
+        paragraph = doc.add_paragraph()
+        paragraph.add_run('Раздел ')
+        paragraph.add_run('1').italic = True
+
+    runs = _process(tmp_path, build).paragraphs[0].runs
+
+    assert [run.text for run in runs] == ['Раздел ', '1']
+    assert runs[1].italic
+
+
+def test_tracked_insertion_is_anonymized(tmp_path):
+    def build(doc):
+        paragraph = doc.add_paragraph('Договор заключен с ')
+        paragraph._p.append(parse_xml(
+            f'<w:ins {nsdecls("w")} w:id="1" w:author="A"><w:r><w:t>Иваном Петровым, ИНН 7707083893</w:t></w:r></w:ins>'
+        ))
+
+    result = _process(tmp_path, build)
+    paragraph = result.paragraphs[0]
+
+    assert '7707083893' not in paragraph._p.xml
+    assert paragraph.text.startswith('Договор заключен с ')
+    assert paragraph.text.endswith(', ИНН [ИНН]')
+
+
+def test_nested_table_is_anonymized(tmp_path):
+    def build(doc):
+        cell = doc.add_table(rows=1, cols=1).cell(0, 0)
+        cell.text = 'Реквизиты'
+        cell.add_table(rows=1, cols=1).cell(0, 0).text = 'Паспорт 4510 123456, СНИЛС 112-233-445 95'
+
+    nested_cell = _process(tmp_path, build).tables[0].cell(0, 0).tables[0].cell(0, 0)
+
+    assert nested_cell.text == 'Паспорт [ПАСПОРТ], СНИЛС [СНИЛС]'
+
+
+def test_special_spaces_are_kept_in_output(tmp_path):
+    def build(doc):
+        doc.add_paragraph('\ufeffДоговор №\u00a05, г.\u00a0Санкт-Петербург')
+        paragraph = doc.add_paragraph()
+        paragraph.add_run('ИНН\u00a07707083893, ')
+        paragraph.add_run('пункт\u00a03').bold = True
+
+    paragraphs = _process(tmp_path, build).paragraphs
+
+    assert paragraphs[0].text.startswith('\ufeffДоговор №\u00a05, г.\u00a0')
+    assert [run.text for run in paragraphs[1].runs] == ['ИНН\u00a0[ИНН], ', 'пункт\u00a03']
+
+
+def test_repeated_fragments_reuse_cached_ner():
+    text = 'Представитель Иван Петров действует на основании доверенности.'
+    first = DocumentAnonymizer.find_spans([text])
+    hits = ner_cache.hits
+
+    assert DocumentAnonymizer.find_spans([text, text]) == first * 2
+    assert ner_cache.hits == hits + 1
+    assert text not in ner_cache._data
+
+
+def test_simple_pdf_lines_have_single_breaks(tmp_path):
+    input_path = str(tmp_path / 'input.pdf')
+    output_path = str(tmp_path / 'output.docx')
+    _make_text_pdf(input_path, ['Dogovor 1', 'INN 7707083893', 'Data 2024'])
+
+    FileProcessor.process_pdf_simple(input_path, output_path)
+    paragraphs = Document(output_path).paragraphs
+
+    assert [paragraph.text for paragraph in paragraphs] == ['Dogovor 1\nINN [ИНН]\nData 2024']
+
+
+def test_text_only_pdf_skips_layout_conversion(tmp_path, monkeypatch):
+    input_path = str(tmp_path / 'input.pdf')
+    output_path = str(tmp_path / 'output.docx')
+    _make_text_pdf(input_path, ['Dogovor 1', 'INN 7707083893'])
+
+    # process_pdf перехватывает исключения Converter, поэтому вызовы записываются, а не запрещаются
+    converter_calls = []
+    monkeypatch.setattr(telegram_anonymizer_bot, 'Converter', lambda *args: converter_calls.append(args))
+    FileProcessor.process_pdf(input_path, output_path)
+
+    assert converter_calls == []
+    assert [paragraph.text for paragraph in Document(output_path).paragraphs] == ['Dogovor 1\nINN [ИНН]']
+
+
+def test_pdf_with_graphics_is_not_text_only(tmp_path):
+    input_path = str(tmp_path / 'input.pdf')
+    _make_text_pdf(input_path, ['Dogovor 1'], with_rect=True)
+
+    assert not FileProcessor.is_text_only_pdf(input_path)
+
+
+def test_broken_ner_pool_falls_back_and_is_recreated(tmp_path, monkeypatch):
+    pool = ProcessPoolExecutor(max_workers=1)
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result()
+    monkeypatch.setattr(telegram_anonymizer_bot, '_ner_pool', pool)
+    monkeypatch.setattr(telegram_anonymizer_bot, 'PARALLEL_MIN_FRAGMENTS', 1)
+
+    def build(doc):
+        doc.add_paragraph('ИНН 7707083893')
+
+    paragraphs = _process(tmp_path, build).paragraphs
+
+    assert paragraphs[0].text == 'ИНН [ИНН]'
+    assert telegram_anonymizer_bot._ner_pool is None
+
+
+def test_large_document_uses_ner_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(telegram_anonymizer_bot, '_ner_pool', None)
+    monkeypatch.setattr(telegram_anonymizer_bot, 'NER_WORKERS', 2)
+    monkeypatch.setattr(telegram_anonymizer_bot, 'PARALLEL_MIN_FRAGMENTS', 2)
+
+    def build(doc):
+        for i in range(4):
+            doc.add_paragraph(f'Пункт {i}. ИНН 7707083893')
+
+    try:
+        paragraphs = _process(tmp_path, build).paragraphs
+        assert telegram_anonymizer_bot._ner_pool is not None
+    finally:
+        if telegram_anonymizer_bot._ner_pool is not None:
+            telegram_anonymizer_bot._ner_pool.shutdown()
+
+    assert [paragraph.text for paragraph in paragraphs] == [f'Пункт {i}. ИНН [ИНН]' for i in range(4)]